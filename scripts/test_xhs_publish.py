@@ -0,0 +1,316 @@
+"""
+Regression tests for the browserless parts of xhs_publish.py.
+
+Run from the repo root (no Playwright needed):
+    python -m unittest discover -s scripts -p "test_*.py"
+"""
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+import xhs_publish as xp
+
+PROXY = "http://proxy.test:8080"
+
+
+class ProxyEjectionTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = Path(tempfile.mkdtemp())
+        self.pool = xp.ProxyPool([xp.parse_proxy(PROXY)], self.work_dir / "proxy_health.json")
+
+    def health(self):
+        return self.pool._load()["proxies"][PROXY]
+
+    def expire_ejection(self):
+        state = self.pool._load()
+        state["proxies"][PROXY]["ejectedUntil"] = time.time() - 1
+        self.pool._save(state)
+
+    def test_failing_again_after_ejection_expires_ejects_again(self):
+        for _ in range(xp.PROXY_MAX_FAILURES):
+            self.pool.report_failure(PROXY)
+        self.assertEqual(self.pool.healthy(), [])
+
+        self.expire_ejection()
+        self.assertEqual(self.pool.healthy(), [PROXY])  # half-open
+
+        self.pool.report_failure(PROXY)
+        self.assertGreater(self.health()["ejectedUntil"], time.time())
+        self.assertEqual(self.pool.healthy(), [])
+
+    def test_success_after_ejection_expires_restores_proxy(self):
+        for _ in range(xp.PROXY_MAX_FAILURES):
+            self.pool.report_failure(PROXY)
+        self.expire_ejection()
+
+        self.pool.report_success(PROXY, latency_ms=120)
+        health = self.health()
+        self.assertEqual(health["failures"], 0)
+        self.assertNotIn("ejectedUntil", health)
+
+        self.pool.report_failure(PROXY)
+        self.assertEqual(self.pool.healthy(), [PROXY])
+
+
+class FakeLocator:
+    def __init__(self):
+        self.first = self
+        self.clicks = 0
+
+    async def count(self):
+        return 1
+
+    async def click(self):
+        self.clicks += 1
+
+
+class FakePage:
+    url = "https://creator.test/publish/publish"
+
+    def __init__(self):
+        self.button = FakeLocator()
+
+    def locator(self, selector):
+        return self.button
+
+
+class RejectedPublishRetryTest(unittest.TestCase):
+    def setUp(self):
+        self.payload = {
+            "jobId": "xhs_test_rejected",
+            "title": "title",
+            "content": "content",
+            "images": ["https://media.test/a.png"],
+            "workDir": tempfile.mkdtemp(),
+        }
+        self._patched = {name: getattr(xp, name) for name in ("human_delay", "watch_publish_responses")}
+
+        async def no_delay(*args, **kwargs):
+            pass
+
+        def rejecting_watcher(page):
+            future = asyncio.get_running_loop().create_future()
+            future.set_result({"ok": False, "noteId": None, "message": "标题含违禁词", "status": 200})
+            return future, lambda: None
+
+        xp.human_delay = no_delay
+        xp.watch_publish_responses = rejecting_watcher
+
+    def tearDown(self):
+        for name, value in self._patched.items():
+            setattr(xp, name, value)
+
+    def test_retry_after_api_rejection_is_allowed(self):
+        async def attempt():
+            job = xp.PublishJob(self.payload, cookie="a1=test")
+            self.assertIsNone(await xp.preflight_publish(job))
+            page = FakePage()
+            try:
+                with self.assertRaises(xp.PublishRejected):
+                    await xp.phase_submit(page, job)
+            finally:
+                xp.release_ledger_entry(job, "failed", error="rejected")
+            self.assertEqual(page.button.clicks, 1)
+            self.assertFalse(job.checkpoint.done("submitted"))
+            self.assertTrue(job.checkpoint.done("rejected"))
+
+            retry = xp.PublishJob(self.payload, cookie="a1=test")
+            self.assertIsNone(await xp.preflight_publish(retry))
+            xp.release_ledger_entry(retry, "failed", error="test over")
+
+        asyncio.run(attempt())
+
+
+class LedgerReuseTest(unittest.TestCase):
+    def job(self, job_id, title):
+        job = xp.PublishJob({
+            "jobId": job_id,
+            "title": title,
+            "content": "content",
+            "images": ["https://media.test/a.png"],
+            "workDir": self.work_dir,
+            "idempotencyKey": "campaign-1",
+        }, cookie="a1=test")
+        job.ledger_key = xp.ledger_key(job)
+        return job
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+
+    def test_live_key_with_new_content_is_refused(self):
+        self.assertEqual(xp.claim_ledger_row(self.job("xhs_first", "title"))[0], "claimed")
+        with self.assertRaises(RuntimeError):
+            xp.claim_ledger_row(self.job("xhs_second", "other title"))
+
+    def test_expired_key_with_new_content_is_taken_over(self):
+        self.assertEqual(xp.claim_ledger_row(self.job("xhs_first", "title"))[0], "claimed")
+        conn = xp.open_ledger(self.work_dir)
+        conn.execute("UPDATE jobs SET updated = ?", (time.time() - xp.LEDGER_TTL_HOURS * 3600 - 1,))
+        conn.commit()
+        conn.close()
+        self.assertEqual(xp.claim_ledger_row(self.job("xhs_second", "other title"))[0], "claimed")
+
+
+class JobLogRotationTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = Path(tempfile.mkdtemp())
+        self._max_bytes = xp.JOB_LOG_MAX_BYTES
+        xp.JOB_LOG_MAX_BYTES = 64
+
+    def tearDown(self):
+        xp.JOB_LOG_MAX_BYTES = self._max_bytes
+
+    def read_segment(self, path):
+        index = Path(f"{path}.idx").read_bytes()
+        first_line = xp.JOB_INDEX_RECORD.unpack_from(index)[0]
+        count = len(index) // xp.JOB_INDEX_RECORD.size - 1
+        return first_line, Path(path).read_text(encoding="utf-8").splitlines()[:count]
+
+    def test_rotated_segment_keeps_its_index(self):
+        job_log = xp.JobLog(self.work_dir, "xhs_rotate")
+        for n in range(10):
+            job_log.write(f"line {n:02d} " + "x" * 10)
+        job_log.close()
+
+        path = self.work_dir / "xhs_rotate.log"
+        first_line, lines = self.read_segment(path)
+        prev_first, prev_lines = self.read_segment(f"{path}.1")
+        self.assertEqual(prev_first + len(prev_lines), first_line)
+        self.assertTrue(lines[0].startswith(f"line {first_line:02d}"))
+        self.assertTrue(prev_lines[0].startswith(f"line {prev_first:02d}"))
+        self.assertEqual(list(self.work_dir.glob("*.tmp")), [])
+
+
+class UnknownVideoTest(unittest.TestCase):
+    def validate(self, head, content_type):
+        validator = xp.MediaValidator("video", content_type=content_type)
+        validator.feed(head + bytes(range(256)) * 4)
+        return validator.finish()["format"]
+
+    def test_zero_filled_body_is_rejected(self):
+        with self.assertRaises(xp.MediaValidationError):
+            self.validate(bytes(4096), "video/mp4")
+
+    def test_text_body_is_rejected(self):
+        with self.assertRaises(xp.MediaValidationError):
+            self.validate(b"upstream timed out, please retry later. " * 4, "video/mp4")
+
+    def test_unknown_container_needs_video_content_type(self):
+        head = os.urandom(4096)
+        self.assertEqual(self.validate(head, "video/x-custom"), "unknown")
+        for content_type in ("application/octet-stream", ""):
+            with self.assertRaises(xp.MediaValidationError):
+                self.validate(head, content_type)
+
+    def test_known_signature_needs_no_content_type(self):
+        self.assertEqual(self.validate(b"\x1a\x45\xdf\xa3" + os.urandom(64), ""), "matroska")
+
+
+class FakeCDPSession:
+    def __init__(self, replies):
+        self.replies = list(replies)
+
+    async def send(self, method, params=None):
+        if method != "Performance.getMetrics":
+            return {}
+        reply = self.replies.pop(0)
+        if reply == "hang":
+            await asyncio.sleep(1)
+        if isinstance(reply, Exception):
+            raise reply
+        return {"metrics": [{"name": "Nodes", "value": 42}]}
+
+
+class FakeContext:
+    def __init__(self, session=None, error=None):
+        self.session = session
+        self.error = error
+        self.sessions = 0
+
+    async def new_cdp_session(self, page):
+        self.sessions += 1
+        if self.error:
+            raise self.error
+        return self.session
+
+
+class RendererSampleTest(unittest.TestCase):
+    def setUp(self):
+        self._timeout = xp.RENDERER_SAMPLE_TIMEOUT
+        xp.RENDERER_SAMPLE_TIMEOUT = 0.05
+
+    def tearDown(self):
+        xp.RENDERER_SAMPLE_TIMEOUT = self._timeout
+
+    def session(self, context):
+        session = xp.RendererSession()
+        session.context, session.page = context, FakePage()
+        return session
+
+    def test_timeout_skips_only_that_sample(self):
+        session = self.session(FakeContext(FakeCDPSession(["hang", "ok"])))
+
+        async def run():
+            self.assertIsNone(await session.sample())
+            self.assertEqual((await session.sample())["nodes"], 42)
+
+        asyncio.run(run())
+
+    def test_unsupported_browser_stops_sampling(self):
+        context = FakeContext(error=RuntimeError("CDP session is only available in Chromium"))
+        session = self.session(context)
+
+        async def run():
+            self.assertIsNone(await session.sample())
+            self.assertIsNone(await session.sample())
+
+        asyncio.run(run())
+        self.assertEqual(context.sessions, 1)
+
+
+class AccountNameTest(unittest.TestCase):
+    def errors(self, account):
+        return xp.validate_payload({
+            "title": "title", "content": "content", "images": ["https://media.test/a.png"], "account": account,
+        })
+
+    def test_plain_names_are_accepted(self):
+        for account in ("default", "acct_01", "brand-b"):
+            self.assertEqual(self.errors(account), [])
+
+    def test_path_like_names_are_rejected(self):
+        for account in ("../other", "a/b", "..", "", "a" * 65, "acct\n", 7):
+            self.assertEqual(len(self.errors(account)), 1, account)
+
+
+class ReapOrphansTest(unittest.TestCase):
+    def setUp(self):
+        self.profile = Path(tempfile.mkdtemp(prefix=xp.CHROMIUM_PROFILE_PREFIX))
+        stale = time.time() - xp.STALE_PROFILE_SECONDS - 60
+        os.utime(self.profile, (stale, stale))
+        self._list_processes = xp.list_processes
+
+    def tearDown(self):
+        xp.list_processes = self._list_processes
+        shutil.rmtree(self.profile, ignore_errors=True)
+
+    def test_no_process_list_leaves_profiles_alone(self):
+        xp.list_processes = lambda: None
+        result = xp.reap_orphans(kill_browsers=True)
+        self.assertEqual(result["killed"], [])
+        self.assertEqual(result["profiles"], [])
+        self.assertTrue(self.profile.exists())
+
+    def test_orphan_browsers_are_not_killed_by_default(self):
+        xp.list_processes = lambda: [(999999, 1, [f"--user-data-dir=/tmp/{xp.CHROMIUM_PROFILE_PREFIX}other"])]
+        result = xp.reap_orphans(dry_run=True)
+        self.assertEqual(result["killed"], [])
+        self.assertIn(str(self.profile), result["profiles"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,588 @@
+"""
+Load test for the publish pipeline and the state it shares on disk.
+
+Starts a local stand-in for the creator publish page and a media server, then
+launches N publish jobs at a configurable arrival rate, each as its own
+`xhs_publish.py publish` process exactly like the Node route does. Afterwards
+the work directory is audited: publish history records that went missing,
+JSON files that no longer parse, and temp media, .part files, ledger entries
+or browsers that were left behind.
+
+Usage:
+    python scripts/xhs_loadtest.py --jobs 20 --rate 2
+    python scripts/xhs_loadtest.py --jobs 200 --rate 0 --mode state
+
+--mode browser (default) runs the real publisher against the stand-in page and
+needs Playwright. --mode state skips the browser and drives the same shared
+state a publish touches (ledger, checkpoints, rate-limit history, cookie file,
+downloads, cleanup) to find the ceiling of the file-based state alone.
+"""
+import argparse
+import asyncio
+import collections
+import http.server
+import json
+import os
+import random
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+import zlib
+from pathlib import Path
+
+import xhs_publish as xp
+
+SCRIPT_PATH = Path(__file__).resolve().parent / "xhs_publish.py"
+PUBLISH_API_PATH = "/web_api/sns/v2/note"
+HISTORY_KEEP = 100  # record_publish keeps the last 100 entries
+
+
+# ============= Stand-in Servers =============
+
+STANDIN_PAGE = """<!doctype html>
+<html>
+<head><meta charset="utf-8"><title>creator publish stand-in</title></head>
+<body>
+<div id="creator-publish-dom">
+  <input class="upload-input" type="file" multiple>
+  <div id="previews"></div>
+</div>
+<div id="editor-root"></div>
+<script>
+const target = new URLSearchParams(location.search).get('target') === 'video' ? 'video' : 'note';
+const input = document.querySelector('input.upload-input');
+input.accept = target === 'video' ? '.mp4,.mov,video/mp4' : '.jpg,.jpeg,.png,.webp,image/*';
+let mediaCount = 0;
+
+function showEditor() {
+  if (document.querySelector('.ql-editor')) return;
+  document.getElementById('editor-root').innerHTML =
+    '<div class="plugin title-container"><input class="d-text" placeholder="填写标题会有更多赞哦"></div>' +
+    '<div class="ql-editor" contenteditable="true"></div>' +
+    '<button class="publishBtn">发布</button>';
+  document.querySelector('.publishBtn').addEventListener('click', publish);
+}
+
+input.addEventListener('change', () => {
+  const files = Array.from(input.files);
+  mediaCount += files.length;
+  if (target === 'video') {
+    const stage = document.createElement('div');
+    stage.className = 'stage';
+    stage.textContent = '上传中 0%';
+    input.insertAdjacentElement('afterend', stage);
+    let percent = 0;
+    const timer = setInterval(() => {
+      percent += 25;
+      stage.textContent = percent >= 100 ? '上传成功' : `上传中 ${percent}%`;
+      if (percent >= 100) clearInterval(timer);
+    }, UPLOAD_STEP_MS);
+  } else {
+    for (const file of files) {
+      const box = document.createElement('div');
+      box.className = 'img-container';
+      const img = document.createElement('img');
+      img.src = URL.createObjectURL(file);
+      box.appendChild(img);
+      document.getElementById('previews').appendChild(box);
+    }
+  }
+  showEditor();
+});
+
+async function publish() {
+  const body = {
+    title: document.querySelector('.title-container input').value,
+    content: document.querySelector('.ql-editor').innerText,
+    media: mediaCount,
+    target,
+  };
+  const response = await fetch('PUBLISH_API_PATH', {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify(body),
+  });
+  const data = await response.json();
+  if (data.success) document.body.insertAdjacentHTML('beforeend', '<div class="toast">发布成功</div>');
+}
+</script>
+</body>
+</html>
+"""
+
+
+def make_png(width, height, seed):
+    """A small valid RGB PNG, so the page thumbnail really decodes."""
+    row = bytes([0]) + bytes((seed * 7 + x) % 256 for x in range(width * 3))
+    raw = row * height
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw)) + chunk(b"IEND", b"")
+
+
+def make_mp4(size):
+    """ftyp box plus filler: enough for the publisher's checks and the stand-in page."""
+    ftyp = struct.pack(">I", 24) + b"ftypisom" + struct.pack(">I", 512) + b"isomiso2"
+    mdat_size = max(size - len(ftyp), 16)
+    return ftyp + struct.pack(">I", mdat_size) + b"mdat" + bytes(mdat_size - 8)
+
+
+class StandinState:
+    def __init__(self, media_latency_ms, upload_step_ms):
+        self.media_latency_ms = media_latency_ms
+        self.upload_step_ms = upload_step_ms
+        self.lock = threading.Lock()
+        self.notes = []
+        self.media_requests = collections.Counter()
+        self.media = {}
+
+    def add_note(self, body):
+        with self.lock:
+            note_id = f"loadtest{len(self.notes) + 1:06d}"
+            self.notes.append({"noteId": note_id, **body})
+            return note_id
+
+
+class StandinHandler(http.server.BaseHTTPRequestHandler):
+    standin = None  # StandinState, set on the server subclass
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def do_GET(self):
+        path = urllib.parse.urlsplit(self.path).path
+        if path.startswith("/publish/"):
+            page = STANDIN_PAGE.replace("UPLOAD_STEP_MS", str(self.standin.upload_step_ms))
+            page = page.replace("PUBLISH_API_PATH", PUBLISH_API_PATH)
+            self._send(200, page.encode("utf-8"), "text/html; charset=utf-8")
+            return
+        if path.startswith("/media/"):
+            name = path[len("/media/"):]
+            body = self.standin.media.get(name)
+            if body is None:
+                self._send(404, b"not found", "text/plain")
+                return
+            self.standin.media_requests[name] += 1
+            if self.standin.media_latency_ms:
+                time.sleep(self.standin.media_latency_ms / 1000)
+            self._send(200, body, "video/mp4" if name.endswith(".mp4") else "image/png")
+            return
+        self._send(200, b"<html><body>stand-in</body></html>", "text/html")
+
+    do_HEAD = do_GET
+
+    def do_POST(self):
+        path = urllib.parse.urlsplit(self.path).path
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            body = {}
+        if path != PUBLISH_API_PATH:
+            self._send(404, b"{}", "application/json")
+            return
+        note_id = self.standin.add_note(body)
+        response = {"success": True, "code": 0, "data": {"note_id": note_id}}
+        self._send(200, json.dumps(response).encode("utf-8"), "application/json")
+
+
+def start_standin(args):
+    state = StandinState(args.media_latency_ms, args.upload_step_ms)
+    for index in range(args.media_pool):
+        state.media[f"image_{index}.png"] = make_png(320, 240, index)
+    state.media["video_0.mp4"] = make_mp4(args.video_kb * 1024)
+    handler = type("Handler", (StandinHandler,), {"standin": state})
+    # the default backlog of 5 resets connections when all jobs arrive at once
+    server_class = type("Server", (http.server.ThreadingHTTPServer,), {"request_queue_size": max(64, args.jobs * 4)})
+    server = server_class(("127.0.0.1", args.port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state
+
+
+# ============= End Stand-in Servers =============
+
+
+# ============= Job Generation =============
+
+def build_payloads(args, origin, work_dir, run_id):
+    payloads = []
+    for index in range(args.jobs):
+        video = random.random() < args.video_ratio
+        payload = {
+            "jobId": f"xhs_lt{run_id}_{index:05d}",
+            # unique content, so the job ledger never treats two jobs as one
+            "title": f"loadtest {run_id} #{index}",
+            "content": f"load test note {index}",
+            "tags": [],
+            "sourceUrl": f"{origin}/",
+            "workDir": str(work_dir),
+        }
+        if args.accounts > 1:
+            payload["account"] = f"acct{index % args.accounts}"
+        if video:
+            payload["noteType"] = "video"
+            payload["videoUrl"] = f"{origin}/media/video_0.mp4"
+        else:
+            # campaigns share media, which is what the download coalescing sees
+            picks = random.sample(range(args.media_pool), min(args.images, args.media_pool))
+            payload["images"] = [f"{origin}/media/image_{pick}.png" for pick in picks]
+        payloads.append(payload)
+    return payloads
+
+
+def arrival_delays(args):
+    """Seconds after start at which each job arrives."""
+    if args.rate <= 0:
+        return [0.0] * args.jobs
+    delays = []
+    at = 0.0
+    for _ in range(args.jobs):
+        delays.append(at)
+        at += random.expovariate(args.rate) if args.arrival == "poisson" else 1.0 / args.rate
+    return delays
+
+
+# ============= End Job Generation =============
+
+
+# ============= Job Runners =============
+
+def job_env(args, origin):
+    env = dict(os.environ)
+    env.update({
+        "XHS_CREATOR_ORIGIN": origin,
+        "XHS_COOKIE": env.get("XHS_LOADTEST_COOKIE", "a1=loadtest; web_session=loadtest"),
+        "XHS_HEADLESS": "true",
+        "XHS_MIN_INTERVAL_SECONDS": "0",
+        "XHS_DAILY_LIMIT": "1000000",
+        "XHS_MIN_DELAY_MS": str(args.human_delay_ms),
+        "XHS_MAX_DELAY_MS": str(args.human_delay_ms * 2),
+        "XHS_STEALTH_MODE": "false",
+        "XHS_REAP_ORPHANS": "false",  # the audit counts orphans instead
+        "PYTHONIOENCODING": "utf-8",
+    })
+    # a proxy pool or shared browser of the host would skew the numbers
+    for name in ("XHS_PROXY_POOL", "XHS_PROXY_URL", "XHS_PUBLISH_LOG", "XHS_COOKIE_FILE", "XHS_LEDGER_FILE", "XHS_PERF_DB"):
+        env.pop(name, None)
+    return env
+
+
+async def run_job(args, payload, payload_dir, env, command):
+    payload_path = payload_dir / f"{payload['jobId']}.json"
+    payload_path.write_text(json.dumps(payload, ensure_ascii=False), encoding="utf-8")
+    start = time.monotonic()
+    proc = await asyncio.create_subprocess_exec(
+        *command, "--payload", str(payload_path), "--progress", "ndjson",
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, env=env,
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(proc.communicate(), args.timeout)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        return {"jobId": payload["jobId"], "ok": False, "error": "timeout", "latency": time.monotonic() - start}
+
+    result = None
+    for line in stdout.decode("utf-8", "replace").splitlines():
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if record.get("type") == "result":
+            result = record
+    ok = proc.returncode == 0 and bool(result and result.get("ok"))
+    error = None
+    if not ok:
+        error = (result or {}).get("error") or (stderr.decode("utf-8", "replace").strip().splitlines() or ["?"])[-1]
+    return {
+        "jobId": payload["jobId"],
+        "ok": ok,
+        "noteId": (result or {}).get("noteId"),
+        "error": error,
+        "latency": time.monotonic() - start,
+    }
+
+
+async def run_jobs(args, payloads, payload_dir, env):
+    if args.mode == "browser":
+        command = [sys.executable, str(SCRIPT_PATH), "publish"]
+    else:
+        command = [sys.executable, str(Path(__file__).resolve()), "state-worker"]
+    delays = arrival_delays(args)
+    started = time.monotonic()
+
+    async def arrive(payload, delay):
+        await asyncio.sleep(max(0.0, delay - (time.monotonic() - started)))
+        return await run_job(args, payload, payload_dir, env, command)
+
+    results = await asyncio.gather(*(arrive(payload, delay) for payload, delay in zip(payloads, delays)))
+    return results, time.monotonic() - started
+
+
+class StandinRequestContext:
+    """Minimal APIRequestContext over urllib for the browserless state mode."""
+
+    class Response:
+        def __init__(self, status, headers, body):
+            self.status = status
+            self.headers = {key.lower(): value for key, value in headers.items()}
+            self._body = body
+
+        async def body(self):
+            return self._body
+
+    async def get(self, url, headers=None, timeout=60000):
+        def fetch():
+            request = urllib.request.Request(url, headers=headers or {})
+            with urllib.request.urlopen(request, timeout=timeout / 1000) as response:
+                return self.Response(response.status, dict(response.headers), response.read())
+        return await asyncio.to_thread(fetch)
+
+
+class StandinContext:
+    request = StandinRequestContext()
+
+
+async def state_worker(payload):
+    """Everything a publish does to shared state, with an HTTP POST in place of the browser."""
+    job = xp.PublishJob(payload)
+    finished = await xp.preflight_publish(job)
+    if finished:
+        return finished
+    succeeded = False
+    try:
+        media_files = await xp.download_media_files(
+            StandinContext, job.media_requests, job.download_dir, job.source_url, job.cookie
+        )
+        job.checkpoint.mark("media_ready", files=media_files)
+        job.checkpoint.mark("submitted")
+        origin = os.environ["XHS_CREATOR_ORIGIN"]
+        body = json.dumps({"title": job.title, "content": job.content, "media": len(media_files)}).encode("utf-8")
+        request = urllib.request.Request(
+            origin + PUBLISH_API_PATH, data=body, headers={"Content-Type": "application/json"}
+        )
+        with urllib.request.urlopen(request, timeout=30) as response:
+            _, note_id, _ = xp.parse_publish_response(response.status, json.loads(response.read()))
+        job.checkpoint.mark("confirmed", noteId=note_id)
+        xp.save_cookies_to_file(xp.parse_cookie(job.cookie), job.cookie_file_path)
+        xp.record_publish(job.account_dir, job.title, note_id)
+        xp.release_ledger_entry(job, "completed", note_id=note_id)
+        succeeded = True
+        return {"noteId": note_id}
+    finally:
+        xp.release_ledger_entry(job, "failed", error="state worker failed")
+        xp.cleanup_job_media(job, succeeded)
+        xp.media_flights.clear()
+
+
+def run_state_worker(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--payload", required=True)
+    parser.add_argument("--progress", default="ndjson")
+    args = parser.parse_args(argv)
+    payload = json.loads(Path(args.payload).read_text(encoding="utf-8"))
+    reporter = xp.ProgressReporter(payload["jobId"])
+    try:
+        result = asyncio.run(state_worker(payload))
+    except Exception as exc:
+        reporter.result(False, error=str(exc))
+        sys.exit(1)
+    reporter.result(True, noteId=result.get("noteId"))
+
+
+# ============= End Job Runners =============
+
+
+# ============= Audit =============
+
+def summarize_latency(values):
+    values = sorted(values)
+    if not values:
+        return {}
+    return {
+        "p50": round(xp.percentile(values, 50), 2),
+        "p90": round(xp.percentile(values, 90), 2),
+        "p99": round(xp.percentile(values, 99), 2),
+        "max": round(values[-1], 2),
+        "mean": round(sum(values) / len(values), 2),
+    }
+
+
+def history_files(work_dir):
+    return [work_dir / "publish_history.json", *sorted(work_dir.glob("accounts/*/publish_history.json"))]
+
+
+def audit_history(work_dir, results, run_id):
+    """Successful jobs whose record_publish entry is missing (bounded by the 100-entry trim)."""
+    ok_titles = collections.Counter()
+    for result in results:
+        if result["ok"]:
+            ok_titles[result["account"]] += 1
+    recorded = collections.Counter()
+    for path in history_files(work_dir):
+        if not path.exists():
+            continue
+        account = path.parent.name if path.parent != work_dir else None
+        try:
+            history = json.loads(path.read_text(encoding="utf-8"))
+        except ValueError:
+            continue  # reported as corrupt JSON
+        recorded[account] += sum(
+            1 for item in history.get("publishes", []) if f"loadtest {run_id} " in item.get("title", "")
+        )
+    expected = sum(min(count, HISTORY_KEEP) for count in ok_titles.values())
+    found = sum(min(recorded[account], HISTORY_KEEP) for account in ok_titles)
+    return {"expected": expected, "recorded": found, "lost": max(0, expected - found)}
+
+
+def audit_json(work_dir, payload_dir):
+    corrupt = []
+    checked = 0
+    for path in work_dir.rglob("*.json"):
+        if payload_dir in path.parents:
+            continue
+        checked += 1
+        try:
+            json.loads(path.read_text(encoding="utf-8"))
+        except (ValueError, UnicodeDecodeError) as exc:
+            corrupt.append({"path": str(path.relative_to(work_dir)), "error": str(exc)[:120]})
+        except OSError:
+            continue
+    return {"checked": checked, "corrupt": corrupt}
+
+
+def audit_leaks(work_dir, profiles_before):
+    leaks = {
+        "mediaDirs": [str(path.name) for path in work_dir.glob("xhs_publish_*") if path.is_dir()],
+        "partFiles": [str(path.relative_to(work_dir)) for path in work_dir.rglob("*.part")],
+        "tmpFiles": [str(path.relative_to(work_dir)) for path in work_dir.rglob("*.tmp")],
+        # shared media is kept for MEDIA_SHARE_SECONDS on purpose; only older files are leaks
+        "sharedMedia": sum(
+            1 for path in work_dir.glob(f"{xp.SHARED_MEDIA_DIR}/*")
+            if time.time() - path.stat().st_mtime > xp.MEDIA_SHARE_SECONDS
+        ),
+        "orphanBrowsers": len(xp.find_orphan_browsers(xp.list_processes() or [])),
+        "chromiumProfiles": max(0, len(chromium_profiles()) - profiles_before),
+        "ledgerRunning": 0,
+    }
+    ledger_path = xp.get_ledger_path(work_dir)
+    if ledger_path.exists():
+        conn = xp.open_ledger(work_dir)
+        try:
+            leaks["ledgerRunning"] = conn.execute("SELECT COUNT(*) FROM jobs WHERE state = 'running'").fetchone()[0]
+        finally:
+            conn.close()
+    return leaks
+
+
+def chromium_profiles():
+    return list(Path(tempfile.gettempdir()).glob(f"{xp.CHROMIUM_PROFILE_PREFIX}*"))
+
+
+def build_report(args, payloads, results, wall, work_dir, payload_dir, standin, run_id, profiles_before):
+    for payload, result in zip(payloads, results):
+        result["account"] = payload.get("account")
+    ok = [result for result in results if result["ok"]]
+    errors = collections.Counter(result["error"] for result in results if not result["ok"])
+    titles = collections.Counter(note.get("title") for note in standin.notes)
+    return {
+        "mode": args.mode,
+        "jobs": args.jobs,
+        "arrival": {"rate": args.rate, "distribution": args.arrival},
+        "wallSeconds": round(wall, 1),
+        "throughputPerMinute": round(len(ok) / wall * 60, 2) if wall else None,
+        "outcomes": {"ok": len(ok), "failed": len(results) - len(ok)},
+        "errors": dict(errors.most_common(5)),
+        "latencySeconds": summarize_latency([result["latency"] for result in results]),
+        "okLatencySeconds": summarize_latency([result["latency"] for result in ok]),
+        "notesPosted": len(standin.notes),
+        "doublePosts": sum(count - 1 for count in titles.values() if count > 1),
+        "mediaServed": sum(standin.media_requests.values()),
+        "history": audit_history(work_dir, results, run_id),
+        "json": audit_json(work_dir, payload_dir),
+        "leaks": audit_leaks(work_dir, profiles_before),
+        "workDir": str(work_dir),
+    }
+
+
+# ============= End Audit =============
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Concurrent load test of the publish pipeline")
+    parser.add_argument("--jobs", type=int, default=20, help="Number of publish jobs (N)")
+    parser.add_argument("--rate", type=float, default=1.0, help="Arrivals per second, 0 = all at once")
+    parser.add_argument("--arrival", choices=("uniform", "poisson"), default="poisson")
+    parser.add_argument("--mode", choices=("browser", "state"), default="browser")
+    parser.add_argument("--accounts", type=int, default=1, help="Spread jobs over this many accounts")
+    parser.add_argument("--images", type=int, default=3, help="Images per note")
+    parser.add_argument("--video-ratio", type=float, default=0.0, help="Share of video notes")
+    parser.add_argument("--media-pool", type=int, default=6, help="Distinct images on the media server")
+    parser.add_argument("--video-kb", type=int, default=512)
+    parser.add_argument("--media-latency-ms", type=int, default=50)
+    parser.add_argument("--upload-step-ms", type=int, default=300, help="Stand-in video upload progress step")
+    parser.add_argument("--human-delay-ms", type=int, default=20, help="XHS_MIN_DELAY_MS for the jobs")
+    parser.add_argument("--timeout", type=float, default=300, help="Per-job timeout in seconds")
+    parser.add_argument("--port", type=int, default=0, help="Stand-in server port (default: any free port)")
+    parser.add_argument("--work-dir", help="Work directory (default: a fresh temp dir)")
+    parser.add_argument("--keep", action="store_true", help="Keep the temp work directory")
+    parser.add_argument("--seed", type=int, help="Random seed for arrivals and media picks")
+    return parser.parse_args(argv)
+
+
+def main():
+    if sys.argv[1:2] == ["state-worker"]:
+        run_state_worker(sys.argv[2:])
+        return
+    args = parse_args()
+    if args.seed is not None:
+        random.seed(args.seed)
+    if args.mode == "browser":
+        try:
+            import playwright  # noqa: F401
+        except ImportError:
+            print("--mode browser needs Playwright; use --mode state without it", file=sys.stderr)
+            sys.exit(2)
+
+    temp_dir = None if args.work_dir else tempfile.mkdtemp(prefix="xhs_loadtest_")
+    work_dir = Path(args.work_dir or temp_dir).resolve()
+    payload_dir = work_dir / "loadtest_payloads"
+    payload_dir.mkdir(parents=True, exist_ok=True)
+    run_id = f"{int(time.time()) % 100000}"
+
+    server, standin = start_standin(args)
+    origin = f"http://127.0.0.1:{server.server_port}"
+    profiles_before = len(chromium_profiles())
+    payloads = build_payloads(args, origin, work_dir, run_id)
+    print(f"load test: {args.jobs} jobs, rate={args.rate}/s, mode={args.mode}, stand-in {origin}", file=sys.stderr)
+    try:
+        results, wall = asyncio.run(run_jobs(args, payloads, payload_dir, job_env(args, origin)))
+        report = build_report(args, payloads, results, wall, work_dir, payload_dir, standin, run_id, profiles_before)
+    finally:
+        server.shutdown()
+        if temp_dir and not args.keep:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    clean = not (report["history"]["lost"] or report["json"]["corrupt"] or report["doublePosts"])
+    sys.exit(0 if clean and report["outcomes"]["failed"] == 0 else 1)
+
+
+if __name__ == "__main__":
+    main()
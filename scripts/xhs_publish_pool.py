@@ -0,0 +1,356 @@
+"""
+Publish many jobs for many accounts inside one shared Chromium.
+
+Every job runs in its own browser context with its account's cookie. A job is
+admitted only while the measured RSS of this process and its Chromium children
+stays under the memory budget; the rest wait in the queue.
+
+Usage:
+    python scripts/xhs_publish_pool.py --jobs jobs.jsonl --accounts accounts.json
+
+jobs.jsonl holds one publish payload per line with an optional "account" field
+(default "default"). accounts.json maps account name to cookie string; XHS_COOKIE
+is used for the "default" account when present.
+
+A finished job leaves its context and publish page open for the account's next
+job. After each phase the page's renderer is sampled over CDP (JS heap, DOM
+nodes, documents); the page or the whole context is recycled once it passes
+XHS_RENDERER_MAX_* or has served XHS_PAGE_MAX_JOBS / XHS_SESSION_MAX_JOBS jobs.
+
+With XHS_PROXY_POOL set, proxies are probed in the background for the whole
+run and each account keeps its proxy while it stays healthy.
+
+With XHS_BROWSER_ENDPOINT set the pool attaches to that browser instead of
+launching one, and reconnects if it goes away between jobs.
+"""
+import argparse
+import asyncio
+import collections
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+import xhs_publish as xp
+
+# Optional: psutil measures RSS on every platform; Linux falls back to /proc
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+MEMORY_BUDGET_MB = int(os.environ.get("XHS_POOL_MEMORY_BUDGET_MB", "2048"))
+JOB_MEMORY_ESTIMATE_MB = int(os.environ.get("XHS_POOL_JOB_MEMORY_MB", "300"))
+PER_ACCOUNT_CONCURRENCY = int(os.environ.get("XHS_POOL_PER_ACCOUNT", "1"))
+MAX_CONCURRENCY = int(os.environ.get("XHS_POOL_MAX_CONCURRENCY", "8"))
+# Idle sessions kept open across jobs (least recently used closed first); 0 = a new context per job
+IDLE_SESSIONS = int(os.environ.get("XHS_POOL_IDLE_SESSIONS", str(MAX_CONCURRENCY)))
+ADMISSION_POLL_SECONDS = 1.0
+REPORT_INTERVAL_SECONDS = 10.0
+MB = 1024 * 1024
+
+
+# ============= Memory Measurement =============
+
+def _proc_rss(pid):
+    try:
+        resident = int(Path(f"/proc/{pid}/statm").read_text().split()[1])
+    except (OSError, ValueError, IndexError):
+        return 0
+    return resident * os.sysconf("SC_PAGE_SIZE")
+
+
+def process_tree_rss(root_pid):
+    """
+    RSS of root_pid and all descendants in bytes, or None if it cannot be
+    measured. Shared pages are counted per process, so this errs high.
+    """
+    if psutil is not None:
+        try:
+            root = psutil.Process(root_pid)
+            total = 0
+            for proc in [root] + root.children(recursive=True):
+                try:
+                    total += proc.memory_info().rss
+                except psutil.Error:
+                    continue
+            return total
+        except psutil.Error:
+            return None
+    if not Path("/proc/self/statm").exists():
+        return None
+    children = collections.defaultdict(list)
+    for pid, ppid, _ in xp.list_processes() or []:
+        children[ppid].append(pid)
+    total = 0
+    stack = [root_pid]
+    while stack:
+        pid = stack.pop()
+        total += _proc_rss(pid)
+        stack.extend(children.get(pid, []))
+    return total
+
+
+class MemoryAdmission:
+    """Admit jobs while measured RSS plus the per-job estimate fits the budget."""
+
+    def __init__(self, budget_mb=MEMORY_BUDGET_MB, job_estimate_mb=JOB_MEMORY_ESTIMATE_MB):
+        self.budget = budget_mb * MB
+        self.job_estimate = job_estimate_mb * MB
+        self.baseline = None
+        self.current = None
+        self.peak = 0
+
+    def sample(self):
+        rss = process_tree_rss(os.getpid())
+        if rss is not None:
+            self.current = rss
+            self.peak = max(self.peak, rss)
+        return rss
+
+    def calibrate(self, running):
+        """Learn the per-job cost from what running jobs actually use."""
+        if self.baseline is None or not running or self.current is None:
+            return
+        observed = (self.current - self.baseline) / running
+        if observed > 0:
+            self.job_estimate = int(0.7 * self.job_estimate + 0.3 * observed)
+
+    def can_admit(self, running):
+        if running == 0:
+            return True
+        rss = self.sample()
+        if rss is None:
+            return True
+        self.calibrate(running)
+        return rss + self.job_estimate <= self.budget
+
+    def report(self):
+        to_mb = lambda value: round(value / MB, 1) if value is not None else None
+        return {
+            "budgetMb": to_mb(self.budget),
+            "baselineMb": to_mb(self.baseline),
+            "currentMb": to_mb(self.current),
+            "peakMb": to_mb(self.peak),
+            "jobEstimateMb": to_mb(self.job_estimate),
+        }
+
+
+# ============= End Memory Measurement =============
+
+
+def load_accounts(path):
+    accounts = {}
+    if os.environ.get("XHS_COOKIE", "").strip():
+        accounts["default"] = os.environ["XHS_COOKIE"].strip()
+    if path:
+        data = json.loads(Path(path).read_text(encoding="utf-8"))
+        for name, cookie in data.items():
+            if isinstance(cookie, str) and cookie.strip():
+                accounts[name] = cookie.strip()
+    return accounts
+
+
+def load_jobs(path):
+    payloads = []
+    for line in Path(path).read_text(encoding="utf-8").splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        payload = json.loads(line)
+        payload.setdefault("account", "default")
+        payload["jobId"] = xp.resolve_job_id(payload)
+        payloads.append(payload)
+    return payloads
+
+
+class PublishPool:
+    """Shared-browser runner with per-account limits and memory admission."""
+
+    def __init__(self, accounts, admission=None, per_account=PER_ACCOUNT_CONCURRENCY, max_concurrency=MAX_CONCURRENCY):
+        self.accounts = accounts
+        self.admission = admission or MemoryAdmission()
+        self.per_account = per_account
+        self.max_concurrency = max_concurrency
+        self.running = collections.Counter()
+        self.stats = collections.defaultdict(lambda: {"running": 0, "peak": 0, "completed": 0, "failed": 0})
+        self.results = []
+        self._playwright = None
+        self._browser = None
+        self._browser_lock = asyncio.Lock()
+        self.idle_sessions = []  # (account, RendererSession), least recently used first
+        self.closed_recycles = collections.Counter()
+
+    def _next_admissible(self, pending):
+        if sum(self.running.values()) >= self.max_concurrency:
+            return None
+        for payload in pending:
+            if self.running[payload["account"]] < self.per_account:
+                return payload
+        return None
+
+    async def _get_browser(self):
+        """Current browser, reconnecting or relaunching once it has gone away."""
+        async with self._browser_lock:
+            if self._browser is None or not self._browser.is_connected():
+                if self._browser is not None:
+                    xp.log_warn("shared browser disconnected, reconnecting")
+                self._browser = await xp.get_browser(self._playwright)
+            return self._browser
+
+    async def _run_job(self, payload):
+        account = payload["account"]
+        job_log = xp.open_job_log(payload)
+        start = time.time()
+        job = None
+        succeeded = False
+        try:
+            cookie = self.accounts.get(account)
+            if not cookie:
+                raise RuntimeError(f"no cookie configured for account {account!r}")
+            job = xp.PublishJob(payload, cookie=cookie)
+            result = await xp.preflight_publish(job) or await self._publish(job, account)
+            succeeded = True
+            self.stats[account]["completed"] += 1
+            self.results.append({"jobId": payload["jobId"], "account": account, "ok": True,
+                                 "noteId": result.get("noteId"), "duplicateOf": result.get("duplicateOf"), "elapsed": round(time.time() - start, 1)})
+            if job_log:
+                job_log.finish(0)
+        except Exception as exc:
+            xp.log_warn(f"job {payload['jobId']} failed: {exc}")
+            self.stats[account]["failed"] += 1
+            self.results.append({"jobId": payload["jobId"], "account": account, "ok": False,
+                                 "error": str(exc), "elapsed": round(time.time() - start, 1)})
+            if job_log:
+                job_log.finish(1, error=str(exc))
+        finally:
+            if job is not None:
+                xp.release_ledger_entry(job, "failed", error="publisher stopped before the browser run finished")
+                xp.cleanup_job_media(job, succeeded)
+            self.running[account] -= 1
+            self.stats[account]["running"] = self.running[account]
+
+    async def _publish(self, job, account):
+        """Publish on an idle session of the account, kept for its next job afterwards."""
+        session = None
+        for index, (owner, idle) in enumerate(self.idle_sessions):
+            if owner == account:
+                session = self.idle_sessions.pop(index)[1]
+                break
+        session = session or xp.RendererSession()
+        try:
+            return await xp.publish_in_browser(await self._get_browser(), job, session)
+        finally:
+            self.idle_sessions.append((account, session))
+            while len(self.idle_sessions) > IDLE_SESSIONS:
+                _, oldest = self.idle_sessions.pop(0)
+                self.closed_recycles.update(oldest.recycles)
+                await oldest.close()
+
+    def renderer_report(self):
+        recycles = collections.Counter(self.closed_recycles)
+        for _, session in self.idle_sessions:
+            recycles.update(session.recycles)
+        return {
+            "idleSessions": len(self.idle_sessions),
+            "recycles": dict(recycles),
+            "sessions": [{"account": account, **session.report()} for account, session in self.idle_sessions],
+        }
+
+    def report(self):
+        return {
+            "accounts": {name: dict(stats) for name, stats in self.stats.items()},
+            "memory": self.admission.report(),
+            "renderer": self.renderer_report(),
+            "mediaSingleFlight": dict(xp.media_flights.stats),
+            "jobs": self.results,
+        }
+
+    async def run(self, payloads, playwright):
+        self._playwright = playwright
+        await self._get_browser()
+        pending = collections.deque(payloads)
+        tasks = set()
+        self.admission.baseline = self.admission.sample()
+        last_report = time.time()
+        while pending or tasks:
+            payload = self._next_admissible(pending)
+            if payload is not None and self.admission.can_admit(len(tasks)):
+                pending.remove(payload)
+                account = payload["account"]
+                self.running[account] += 1
+                stats = self.stats[account]
+                stats["running"] = self.running[account]
+                stats["peak"] = max(stats["peak"], stats["running"])
+                tasks.add(asyncio.create_task(self._run_job(payload)))
+                # let the new context allocate before measuring again
+                await asyncio.sleep(ADMISSION_POLL_SECONDS / 2)
+                continue
+            if tasks:
+                done, _ = await asyncio.wait(tasks, timeout=ADMISSION_POLL_SECONDS, return_when=asyncio.FIRST_COMPLETED)
+                tasks -= done
+            else:
+                await asyncio.sleep(ADMISSION_POLL_SECONDS)
+            if time.time() - last_report >= REPORT_INTERVAL_SECONDS:
+                last_report = time.time()
+                self.admission.sample()
+                memory = self.admission.report()
+                xp.log_step(
+                    f"pool running={len(tasks)} queued={len(pending)} "
+                    f"rss={memory['currentMb']}MB/{memory['budgetMb']}MB "
+                    f"per_account={dict(self.running)}"
+                )
+        self.admission.sample()
+        return self.report()
+
+    async def close(self):
+        for _, session in self.idle_sessions:
+            self.closed_recycles.update(session.recycles)
+            await session.close()
+        self.idle_sessions = []
+        if self._browser is not None:
+            try:
+                await self._browser.close()
+            except Exception:
+                pass
+            self._browser = None
+
+
+async def run_pool(payloads, accounts):
+    from playwright.async_api import async_playwright
+
+    pool = PublishPool(accounts)
+    if xp.REAP_ORPHANS:
+        xp.reap_orphans(xp.get_work_dir({}))
+    # keep proxy health fresh for the whole run instead of probing per job
+    proxy_pool = xp.get_proxy_pool(xp.get_work_dir({}))
+    probes = asyncio.create_task(proxy_pool.run_probes()) if proxy_pool else None
+    async with async_playwright() as playwright:
+        try:
+            return await pool.run(payloads, playwright)
+        finally:
+            if probes:
+                probes.cancel()
+            await pool.close()
+            xp.media_flights.clear()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Publish many jobs in one shared browser")
+    parser.add_argument("--jobs", required=True, help="JSONL file with one publish payload per line")
+    parser.add_argument("--accounts", help="JSON file mapping account name to cookie string")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    accounts = load_accounts(args.accounts)
+    payloads = load_jobs(args.jobs)
+    report = asyncio.run(xp.run_until_signalled(run_pool(payloads, accounts)))
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    sys.exit(0 if all(item["ok"] for item in report["jobs"]) else 1)
+
+
+if __name__ == "__main__":
+    main()
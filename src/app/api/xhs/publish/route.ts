@@ -25,9 +25,15 @@ interface PublishPayload {
   videoUrl?: string;
   noteType?: string;
   sourceUrl?: string;
+  jobId?: string;
+  idempotencyKey?: string;
+  forceResubmit?: boolean;
 }
 
 const DEFAULT_TIMEOUT_MS = 10 * 60 * 1000;
+const DEFAULT_STALL_MS = 3 * 60 * 1000;
+// Time the publisher gets after SIGTERM to close the browser before SIGKILL
+const KILL_GRACE_MS = 10 * 1000;
 
 // Check if we should use xiaohongshu-mcp
 const USE_MCP = process.env.XHS_USE_MCP !== 'false';
@@ -46,7 +52,13 @@ function sanitizePayload(payload: PublishPayload): PublishPayload {
     images: Array.isArray(payload.images) ? payload.images.filter(url => typeof url === 'string' && url.trim().length > 0) : [],
     videoUrl: payload.videoUrl?.trim(),
     noteType: payload.noteType,
-    sourceUrl: payload.sourceUrl?.trim()
+    sourceUrl: payload.sourceUrl?.trim(),
+    jobId: typeof payload.jobId === 'string' && /^xhs_[a-z0-9_]+$/i.test(payload.jobId) ? payload.jobId : undefined,
+    idempotencyKey: typeof payload.idempotencyKey === 'string' && payload.idempotencyKey.trim()
+      ? payload.idempotencyKey.trim().slice(0, 200)
+      : undefined,
+    // Confirms a re-publish after a submit whose outcome the publisher could not see
+    forceResubmit: payload.forceResubmit === true ? true : undefined
   };
 }
 
@@ -86,20 +98,55 @@ async function publishWithMCP(payload: PublishPayload): Promise<{ success: boole
   }
 }
 
+/**
+ * Progress records written by scripts/xhs_publish.py with --progress ndjson
+ */
+export interface PublishProgressEvent {
+  v: number;
+  type: 'progress' | 'result';
+  jobId: string;
+  phase?: string;
+  percent?: number;
+  bytes?: Record<'download' | 'upload', { done: number; total: number }>;
+  eta?: number | null;
+  ok?: boolean;
+  error?: string | null;
+  elapsed?: number;
+  noteId?: string | null;
+  duplicateOf?: string | null;
+  ts: number;
+}
+
+interface PythonPublishOptions {
+  onEvent?: (event: PublishProgressEvent) => void;
+  signal?: AbortSignal;
+}
+
 /**
  * Publish using Python script (fallback)
  */
-async function publishWithPython(payload: PublishPayload): Promise<{ success: boolean; error?: string; output?: string }> {
+async function publishWithPython(
+  payload: PublishPayload,
+  jobId: string,
+  options: PythonPublishOptions = {}
+): Promise<{ success: boolean; error?: string; output?: string; noteId?: string | null; duplicateOf?: string | null }> {
   const noteType = resolveNoteType(payload);
   const workDir = path.join(process.cwd(), 'data', 'publish');
   await mkdir(workDir, { recursive: true });
   const payloadPath = path.join(workDir, `xhs_publish_${Date.now()}.json`);
-  await writeFile(payloadPath, JSON.stringify({ ...payload, noteType }, null, 2), 'utf-8');
+  await writeFile(payloadPath, JSON.stringify({ ...payload, noteType, jobId, workDir }, null, 2), 'utf-8');
 
   const python = process.env.PYTHON_BIN || process.env.PYTHON || 'python';
   const scriptPath = path.join(process.cwd(), 'scripts', 'xhs_publish.py');
-  const args = [scriptPath, '--payload', payloadPath];
   const timeoutMs = Number.parseInt(process.env.XHS_PUBLISH_TIMEOUT_MS || '', 10) || DEFAULT_TIMEOUT_MS;
+  const stallMs = Number.parseInt(process.env.XHS_PUBLISH_STALL_MS || '', 10) || DEFAULT_STALL_MS;
+  // The script fails on its own deadline first, leaving room for a clean shutdown
+  const deadlineSeconds = Math.max(30, Math.floor((timeoutMs - 2 * KILL_GRACE_MS) / 1000));
+  const args = [
+    scriptPath, 'publish', '--payload', payloadPath, '--progress', 'ndjson', '--deadline', String(deadlineSeconds)
+  ];
+
+  let result: PublishProgressEvent | null = null;
 
   const output = await new Promise<{ code: number; stdout: string; stderr: string }>((resolve, reject) => {
     const child = spawn(python, args, {
@@ -110,37 +157,127 @@ async function publishWithPython(payload: PublishPayload): Promise<{ success: bo
 
     let stdout = '';
     let stderr = '';
-    const timeout = setTimeout(() => {
-      child.kill('SIGKILL');
-      reject(new Error('发布超时，请稍后重试'));
-    }, timeoutMs);
+    let pending = '';
+    let settled = false;
+    let exited = false;
+    // Once the publish click may have happened, a cancel would leave the job submitted but unconfirmed
+    let submitting = false;
+
+    const fail = (error: Error) => {
+      if (settled) return;
+      settled = true;
+      clearTimeout(timeout);
+      clearTimeout(stall);
+      // SIGTERM lets the publisher close Chromium and clean up; SIGKILL if it hangs
+      child.kill('SIGTERM');
+      setTimeout(() => {
+        if (!exited) child.kill('SIGKILL');
+      }, KILL_GRACE_MS).unref();
+      reject(error);
+    };
+    const timeout = setTimeout(() => fail(new Error('发布超时，请稍后重试')), timeoutMs);
+    let stall = setTimeout(() => fail(new Error('发布进度长时间无更新，已取消')), stallMs);
+    const onAbort = () => {
+      if (!submitting) fail(new Error('发布已取消'));
+    };
+    options.signal?.addEventListener('abort', onAbort, { once: true });
+
+    const handleLine = (line: string) => {
+      if (!line.trim()) return;
+      let event: PublishProgressEvent;
+      try {
+        event = JSON.parse(line);
+      } catch {
+        stdout += line + '\n';
+        return;
+      }
+      clearTimeout(stall);
+      stall = setTimeout(() => fail(new Error('发布进度长时间无更新，已取消')), stallMs);
+      if (event.type === 'result') result = event;
+      if (event.phase === 'submit') submitting = true;
+      options.onEvent?.(event);
+    };
 
     child.stdout.on('data', chunk => {
-      stdout += chunk.toString();
+      pending += chunk.toString();
+      const lines = pending.split('\n');
+      pending = lines.pop() ?? '';
+      lines.forEach(handleLine);
     });
     child.stderr.on('data', chunk => {
       stderr += chunk.toString();
     });
     child.on('error', err => {
-      clearTimeout(timeout);
-      reject(err);
+      options.signal?.removeEventListener('abort', onAbort);
+      fail(err);
     });
     child.on('close', code => {
+      exited = true;
+      options.signal?.removeEventListener('abort', onAbort);
+      handleLine(pending);
+      if (settled) return;
+      settled = true;
       clearTimeout(timeout);
+      clearTimeout(stall);
       resolve({ code: code ?? 1, stdout, stderr });
     });
-  });
+  }).finally(() => unlink(payloadPath).catch(() => undefined));
 
-  await unlink(payloadPath).catch(() => undefined);
-
-  if (output.code !== 0) {
+  const finalResult = result as PublishProgressEvent | null;
+  if (output.code !== 0 || (finalResult && !finalResult.ok)) {
     return {
       success: false,
-      error: output.stderr || output.stdout || '发布失败，请检查日志',
+      error: finalResult?.error || output.stderr || output.stdout || '发布失败，请检查日志',
     };
   }
 
-  return { success: true, output: output.stdout };
+  return {
+    success: true,
+    output: finalResult ? JSON.stringify(finalResult) : output.stdout,
+    noteId: finalResult?.noteId ?? null,
+    duplicateOf: finalResult?.duplicateOf ?? null
+  };
+}
+
+/**
+ * Stream Python publish progress to the client as NDJSON.
+ * Closing the request cancels the publish job.
+ */
+function streamPythonPublish(payload: PublishPayload, jobId: string, signal: AbortSignal) {
+  const encoder = new TextEncoder();
+  const stream = new ReadableStream<Uint8Array>({
+    start(controller) {
+      const send = (record: object) => {
+        try {
+          controller.enqueue(encoder.encode(JSON.stringify(record) + '\n'));
+        } catch {
+          // client already went away
+        }
+      };
+      publishWithPython(payload, jobId, { onEvent: send, signal })
+        .then(result => send({ type: 'done', jobId, backend: 'python', ...result }))
+        .catch(error => send({
+          type: 'done',
+          jobId,
+          backend: 'python',
+          success: false,
+          error: error instanceof Error ? error.message : '发布失败，请稍后重试'
+        }))
+        .finally(() => {
+          try {
+            controller.close();
+          } catch {
+            // already closed
+          }
+        });
+    }
+  });
+  return new Response(stream, {
+    headers: {
+      'Content-Type': 'application/x-ndjson; charset=utf-8',
+      'Cache-Control': 'no-cache'
+    }
+  });
 }
 
 export const runtime = 'nodejs';
@@ -148,6 +285,10 @@ export const runtime = 'nodejs';
 export async function POST(request: NextRequest) {
   try {
     const payload = sanitizePayload(await request.json());
+    // A repeated click sends the same key: the publisher returns or follows the first job
+    if (!payload.idempotencyKey) {
+      payload.idempotencyKey = request.headers.get('idempotency-key')?.trim().slice(0, 200) || undefined;
+    }
 
     // Validate
     if (!payload.title || !payload.content) {
@@ -187,14 +328,29 @@ export async function POST(request: NextRequest) {
       return NextResponse.json({ success: false, error: '未配置XHS_COOKIE，无法自动发布' }, { status: 500 });
     }
 
-    console.log('[XHS publish] Using Python script');
-    const result = await publishWithPython(payload);
+    // The Python publisher writes data/publish/<jobId>.log, readable via /api/xhs/publish/status.
+    // Retrying with the previous jobId resumes from its last completed phase.
+    const jobId = payload.jobId || `xhs_${Date.now()}_${Math.random().toString(36).slice(2, 8)}`;
+    console.log('[XHS publish] Using Python script, job', jobId);
+    if (new URL(request.url).searchParams.get('stream') === '1') {
+      return streamPythonPublish(payload, jobId, request.signal);
+    }
+    // Only the stream is a cancel channel: a dropped connection (closed tab, proxy idle
+    // timeout) must not kill a publish that may already be past the click
+    const result = await publishWithPython(payload, jobId);
 
     if (!result.success) {
-      return NextResponse.json({ success: false, error: result.error }, { status: 500 });
+      return NextResponse.json({ success: false, error: result.error, jobId }, { status: 500 });
     }
 
-    return NextResponse.json({ success: true, output: result.output, backend: 'python' });
+    return NextResponse.json({
+      success: true,
+      output: result.output,
+      backend: 'python',
+      jobId,
+      noteId: result.noteId,
+      duplicateOf: result.duplicateOf
+    });
   } catch (error) {
     console.error('[XHS publish] error', error);
     const message = error instanceof Error ? error.message : '发布失败，请稍后重试';
@@ -1,8 +1,11 @@
 import { NextRequest, NextResponse } from 'next/server';
-import { readFile } from 'fs/promises';
+import { open, readFile } from 'fs/promises';
 import path from 'path';
 
 const MAX_LINES = 200;
+const MAX_LINES_AFTER = 1000;
+// Must match JOB_INDEX_RECORD in scripts/xhs_publish.py (little-endian uint64)
+const INDEX_RECORD_SIZE = 8;
 
 function tailLines(text: string, maxLines: number) {
   const lines = text.split(/\r?\n/);
@@ -14,9 +17,107 @@ function isValidJobId(jobId: string) {
   return /^xhs_[a-z0-9_]+$/i.test(jobId);
 }
 
+function parseCount(value: string | null) {
+  if (value === null || value === '') return null;
+  const parsed = Number.parseInt(value, 10);
+  return Number.isFinite(parsed) && parsed >= 0 ? parsed : null;
+}
+
+interface JobStatusRecord {
+  status?: string;
+  exitCode?: number | null;
+  error?: string | null;
+}
+
+/**
+ * Read the lines picked by `range` from one log segment, using its .idx
+ * sidecar so only that slice of the log is read.
+ */
+async function readSegment(
+  logPath: string,
+  range: (firstLine: number, total: number) => [number, number]
+) {
+  const index = await open(`${logPath}.idx`, 'r');
+  try {
+    const { size } = await index.stat();
+    const header = Buffer.alloc(INDEX_RECORD_SIZE);
+    await index.read(header, 0, INDEX_RECORD_SIZE, 0);
+    const firstLine = Number(header.readBigUInt64LE(0));
+    const entries = Math.floor((size - INDEX_RECORD_SIZE) / INDEX_RECORD_SIZE);
+    const total = firstLine + entries;
+    const [start, end] = range(firstLine, total);
+
+    const offsetAt = async (lineNo: number) => {
+      const record = Buffer.alloc(INDEX_RECORD_SIZE);
+      await index.read(record, 0, INDEX_RECORD_SIZE, INDEX_RECORD_SIZE * (1 + lineNo - firstLine));
+      return Number(record.readBigUInt64LE(0));
+    };
+
+    let lines: string[] = [];
+    if (start < end) {
+      const begin = await offsetAt(start);
+      const log = await open(logPath, 'r').catch((error: NodeJS.ErrnoException) => {
+        // mid-rotation: the segment was renamed before its replacement appeared
+        if (error.code === 'ENOENT') return null;
+        throw error;
+      });
+      if (log) {
+        try {
+          const stop = end < total ? await offsetAt(end) : (await log.stat()).size;
+          const buffer = Buffer.alloc(Math.max(0, stop - begin));
+          await log.read(buffer, 0, buffer.length, begin);
+          lines = buffer.toString('utf-8').split(/\r?\n/).slice(0, end - start);
+        } finally {
+          await log.close();
+        }
+      }
+    }
+
+    return { lines, firstLine, total, start };
+  } finally {
+    await index.close();
+  }
+}
+
+/**
+ * Read lines after `after`, or the last `tail` lines. A tail longer than the
+ * current segment is topped up from the previous one (<jobId>.log.1).
+ */
+async function readIndexedLog(logPath: string, after: number | null, tail: number) {
+  const current = await readSegment(logPath, (firstLine, total) => {
+    if (after === null) return [Math.max(firstLine, total - tail), total];
+    const start = Math.max(after, firstLine);
+    return [start, Math.min(total, start + MAX_LINES_AFTER)];
+  });
+
+  let lines = current.lines;
+  if (after === null && lines.length < tail && current.firstLine > 0) {
+    const missing = tail - lines.length;
+    try {
+      const previous = await readSegment(`${logPath}.1`, (firstLine, total) => [
+        Math.max(firstLine, total - missing),
+        total
+      ]);
+      // only a segment that ends where the current one starts is contiguous
+      if (previous.total === current.firstLine) lines = [...previous.lines, ...lines];
+    } catch {
+      // no previous segment kept (XHS_JOB_LOG_KEEP=0) or it has no index
+    }
+  }
+
+  return {
+    lines,
+    firstLine: current.firstLine,
+    nextOffset: current.start + current.lines.length,
+    truncated: after !== null && after < current.firstLine
+  };
+}
+
 export async function GET(request: NextRequest) {
   const { searchParams } = new URL(request.url);
   const jobId = (searchParams.get('jobId') || '').trim();
+  const after = parseCount(searchParams.get('after'));
+  const tail = Math.min(parseCount(searchParams.get('tail')) ?? MAX_LINES, MAX_LINES_AFTER);
 
   if (!isValidJobId(jobId)) {
     return NextResponse.json({ success: false, error: 'invalid jobId' }, { status: 400 });
@@ -24,6 +125,24 @@ export async function GET(request: NextRequest) {
 
   const logPath = path.join(process.cwd(), 'data', 'publish', `${jobId}.log`);
 
+  try {
+    const record: JobStatusRecord = JSON.parse(await readFile(`${logPath}.json`, 'utf-8'));
+    const result = await readIndexedLog(logPath, after, tail);
+    const exitCode = typeof record.exitCode === 'number' ? record.exitCode : null;
+    const finished = exitCode !== null;
+
+    return NextResponse.json({
+      success: true,
+      status: record.status || (finished ? (exitCode === 0 ? 'success' : 'failed') : 'running'),
+      finished,
+      exitCode,
+      error: record.error ?? null,
+      ...result
+    });
+  } catch {
+    // Logs written before the publisher kept an index: fall back to a full read
+  }
+
   try {
     const text = await readFile(logPath, 'utf-8');
     const lines = tailLines(text, MAX_LINES);